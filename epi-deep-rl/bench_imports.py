@@ -0,0 +1,49 @@
+import argparse
+import statistics
+import subprocess
+import sys
+
+# The modules a (pool) worker imports to run simulations, roll out or evaluate policies
+headless_modules = ["sir", "sir_env", "policy_evaluation", "numpy_policy", "learn_sir_policy"]
+
+# These should never be loaded by merely importing one of the headless modules
+heavy_modules = ["matplotlib", "torch", "stable_baselines3", "tensorflow"]
+
+probe = """
+import sys, time
+t = time.perf_counter()
+import {module}
+t = time.perf_counter() - t
+print(t)
+print(",".join(m for m in {heavy} if m in sys.modules))
+"""
+
+
+# Import a module in a fresh interpreter (like a spawned worker) and return the import time and the heavy modules it loaded
+def time_import(module):
+    out = subprocess.run([sys.executable, "-c", probe.format(module=module, heavy=heavy_modules)],
+                         capture_output=True, text=True, check=True).stdout.splitlines()
+    loaded = [m for m in out[1].split(",") if m] if len(out) > 1 else []
+    return float(out[0]), loaded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=5)
+    # Fail when the median import time of a module exceeds this (in seconds)
+    parser.add_argument("--max-time", type=float, default=None)
+    args = parser.parse_args()
+
+    failed = False
+    for module in headless_modules:
+        times = []
+        for _ in range(args.repeats):
+            t, loaded = time_import(module)
+            times.append(t)
+        median = statistics.median(times)
+        print(f"{module:20s} {median * 1000:8.1f} ms  heavy: {', '.join(loaded) if loaded else '-'}")
+
+        if loaded or (args.max_time is not None and median > args.max_time):
+            failed = True
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,39 @@
+import csv
+import numpy as np
+
+
+# Load a POLYMOD-style (Mossong et al. 2008) age-by-age contact matrix from a CSV file:
+# the header holds the age groups of the contacts, every row starts with the age group of the participant, e.g.
+#   age_group,0-4,5-9,...
+#   0-4,1.92,0.65,...
+# Entry (i, j) is the mean number of daily contacts a participant of age group i has with age group j.
+def load_contact_matrix(path):
+    with open(path, newline="") as f:
+        rows = [row for row in csv.reader(f) if row]
+
+    age_groups = [age_group.strip() for age_group in rows[0][1:]]
+    row_groups = [row[0].strip() for row in rows[1:]]
+    if row_groups != age_groups:
+        raise ValueError(f"The rows of {path} ({row_groups}) do not match its columns ({age_groups})")
+
+    matrix = np.array([[float(value) for value in row[1:]] for row in rows[1:]])
+    return age_groups, matrix
+
+
+# The dominant eigenvalue of the next-generation matrix (without the beta / gamma factor), cached per contact matrix.
+# For the SIR model in sir.py, K = beta / gamma * diag(N) C diag(1 / N), which is similar to C,
+# so its dominant eigenvalue is beta / gamma times the spectral radius of C, whatever the population sizes.
+_spectral_radius_cache = {}
+
+def spectral_radius(contact_matrix):
+    contact_matrix = np.asarray(contact_matrix, dtype=float)
+    key = (contact_matrix.shape, contact_matrix.tobytes())
+    if key not in _spectral_radius_cache:
+        _spectral_radius_cache[key] = float(np.max(np.abs(np.linalg.eigvals(contact_matrix))))
+    return _spectral_radius_cache[key]
+
+def R0_from_beta(beta, gamma, contact_matrix):
+    return beta * spectral_radius(contact_matrix) / gamma
+
+def beta_from_R0(R0, gamma, contact_matrix):
+    return R0 * gamma / spectral_radius(contact_matrix)
@@ -0,0 +1,74 @@
+import time
+import gymnasium as gym
+
+# Only metrics_callback needs stable-baselines3, and it imports it on demand
+
+# Aggregated counters of the SIREnv steps (kept as plain numbers, so recording a step is cheap)
+class StepMetrics:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.steps = 0
+        self.step_time = 0.0
+        self.rhs_evals = 0
+        self.solver_steps = 0
+        self.wrapper_steps = 0
+        self.wrapper_time = 0.0
+
+    # Called by SIREnv for every (instrumented) step
+    def record_step(self, step_time, rhs_evals, solver_steps):
+        self.steps += 1
+        self.step_time += step_time
+        self.rhs_evals += rhs_evals
+        self.solver_steps += solver_steps
+
+    # Called by InstrumentWrapper with the time spent in the wrappers around SIREnv
+    def record_wrapper(self, wrapper_time):
+        self.wrapper_steps += 1
+        self.wrapper_time += wrapper_time
+
+    def summary(self):
+        steps = max(self.steps, 1)
+        return {
+            "steps": self.steps,
+            "step_time_ms": 1000 * self.step_time / steps,
+            "rhs_evals_per_step": self.rhs_evals / steps,
+            "solver_steps_per_step": self.solver_steps / steps,
+            "wrapper_time_ms": 1000 * self.wrapper_time / max(self.wrapper_steps, 1),
+            "total_step_time_s": self.step_time,
+            "total_wrapper_time_s": self.wrapper_time,
+        }
+
+
+# Outermost wrapper that measures the overhead of the wrappers in between (NormalizeObservation, NormalizeReward, ...),
+# i.e. the wall time of a step minus the time spent in SIREnv.step itself
+class InstrumentWrapper(gym.Wrapper):
+    def __init__(self, env, metrics):
+        super().__init__(env)
+        self.metrics = metrics
+
+    def step(self, action):
+        start = time.perf_counter()
+        observation, reward, terminated, truncated, info = self.env.step(action)
+        wrapper_time = time.perf_counter() - start - info.get("step_time", 0.0)
+
+        info["wrapper_time"] = wrapper_time
+        self.metrics.record_wrapper(wrapper_time)
+        return observation, reward, terminated, truncated, info
+
+
+# A stable-baselines3 callback that writes the metrics to the model's (tensorboard) logger after every rollout
+def metrics_callback(metrics, prefix="sir"):
+    from stable_baselines3.common.callbacks import BaseCallback
+
+    class MetricsCallback(BaseCallback):
+        def _on_step(self):
+            return True
+
+        def _on_rollout_end(self):
+            for key, value in metrics.summary().items():
+                self.logger.record(f"{prefix}/{key}", value)
+            metrics.reset()
+
+    return MetricsCallback()
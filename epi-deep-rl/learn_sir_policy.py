@@ -5,50 +5,88 @@ import sir
 
 from gymnasium.wrappers import NormalizeObservation, NormalizeReward
 
-from stable_baselines3 import PPO
-from stable_baselines3.common.evaluation import evaluate_policy
+from policy_evaluation import make_scenarios, rollout_policy, evaluate_rollouts
 
-from plot_policy import print_sequence, plot_policy_with_trajectories
+from numpy_policy import export_policy
 
-from validate_gym import validate_gym
+from instrumentation import StepMetrics, InstrumentWrapper, metrics_callback
 
-# Budget parameter
-budget = 2
+# stable-baselines3, plotting and validation are imported in main(), so a worker that imports this module does not load them
 
-# Make the gym env to learn the policy
-env = make_sir_env(budget, seeds=sir.seeds, N_c=sir.N_c, N_a=sir.N_a, gamma=sir.disease_params["gamma"], beta=sir.disease_params["beta"])
 
-# Validate your environment
-validate_gym(env, seeds=sir.seeds, N_c=sir.N_c, N_a=sir.N_a, params=sir.disease_params, budget=budget)
+def main(budget, validate=True, instrument=False):
+    from stable_baselines3 import PPO
+    from plot_policy import print_sequence, plot_policy_with_trajectories
 
-# Wrap the environment to normalize observations and rewards
-env = NormalizeObservation(env)
-env = NormalizeReward(env)
+    # Optionally instrument the environment, to see where the training time goes
+    metrics = StepMetrics() if instrument else None
 
-# Setup the PPO model with a seed and tensorboard logging to monitor the training
-ppo_seed = np.random.randint(0, 1000000)
-ppo_model = PPO(policy="MlpPolicy", 
-                env=env, 
-                learning_rate=2e-3, 
-                verbose=1,
-                seed=ppo_seed, 
-                tensorboard_log="tensorboard_log")
+    # Make the gym env to learn the policy
+    env = make_sir_env(budget, seeds=sir.seeds, N_c=sir.N_c, N_a=sir.N_a, gamma=sir.disease_params["gamma"], beta=sir.disease_params["beta"], metrics=metrics)
 
-# Train the model
-ppo_model.learn(total_timesteps=250000, tb_log_name=f"ppo_budget_{budget}_seed_{ppo_seed}")
+    # Validate your environment
+    if validate:
+        from validate_gym import validate_gym
+        validate_gym(env, seeds=sir.seeds, N_c=sir.N_c, N_a=sir.N_a, params=sir.disease_params, budget=budget)
 
-# Show the results
-mean_reward, std_reward = evaluate_policy(model=ppo_model, 
-                                            env=env, 
-                                            deterministic=True)
-print(f'PPO with budget={budget}')
-print(f"Mean Reward: {mean_reward:.2f}, Std Reward: {std_reward:.2f}")
+    # Wrap the environment to normalize observations and rewards
+    env = NormalizeObservation(env)
+    env = NormalizeReward(env)
+    if instrument:
+        env = InstrumentWrapper(env, metrics)
+        # Do not count the validation steps
+        metrics.reset()
 
-# Print the learned policy
-print_sequence(env, ppo_model, budget)
+    # Setup the PPO model with a seed and tensorboard logging to monitor the training
+    ppo_seed = np.random.randint(0, 1000000)
+    ppo_model = PPO(policy="MlpPolicy",
+                    env=env,
+                    learning_rate=2e-3,
+                    verbose=1,
+                    seed=ppo_seed,
+                    tensorboard_log="tensorboard_log")
 
-# Plot the policy
-plot_policy_with_trajectories(env, ppo_model, budget, ppo_seed)
+    # Train the model
+    ppo_model.learn(total_timesteps=250000,
+                    tb_log_name=f"ppo_budget_{budget}_seed_{ppo_seed}",
+                    callback=metrics_callback(metrics) if instrument else None)
 
-#Close the environment
-env.close()
+    # Export the policy (and the observation normalization) for torch-free inference with numpy_policy.NumpyPolicy
+    export_policy(ppo_model, f"ppo_budget_{budget}_seed_{ppo_seed}.npz", obs_rms=env.get_wrapper_attr("obs_rms"))
+
+    # Roll out the deterministic policy over a few scenarios around the training setup (in one batch),
+    # using the frozen observation normalization statistics of the training environment
+    scenarios = make_scenarios(seeds=[sir.seeds],
+                               betas=[sir.disease_params["beta"], 0.9 * sir.disease_params["beta"], 1.1 * sir.disease_params["beta"]],
+                               populations=[(sir.N_c, sir.N_a)],
+                               budgets=[budget],
+                               gamma=sir.disease_params["gamma"])
+    rollouts = rollout_policy(ppo_model, scenarios, deterministic=True, obs_rms=env.get_wrapper_attr("obs_rms"), seed=ppo_seed)
+
+    # Show the results: the raw (unnormalized) return, i.e. minus the number of new infections, per scenario
+    print(f'PPO with budget={budget}')
+    for scenario, episode_return in zip(scenarios, rollouts["rewards"].sum(axis=1)):
+        print(f"beta={scenario['beta']:.4f}: Return (raw) {episode_return:.2f}")
+    mean_reward, std_reward = evaluate_rollouts(rollouts)
+    print(f"Mean Return over the {len(scenarios)} beta scenarios: {mean_reward:.2f}, Std across scenarios: {std_reward:.2f}")
+
+    # Print the learned policy (for the training scenario)
+    print_sequence(rollouts)
+
+    # Plot the policy (for the training scenario)
+    plot_policy_with_trajectories(rollouts, budget, ppo_seed)
+
+    #Close the environment
+    env.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    # Budget parameter
+    parser.add_argument("--budget", type=int, default=2)
+    parser.add_argument("--skip-validation", action="store_true")
+    # Record the step/solver metrics and write them to the tensorboard log
+    parser.add_argument("--instrument", action="store_true")
+    args = parser.parse_args()
+
+    main(args.budget, validate=not args.skip_validation, instrument=args.instrument)
@@ -0,0 +1,129 @@
+import numpy as np
+
+# Inference needs only NumPy; torch is imported by check_export, when a trained model is exported
+
+activations = {
+    "tanh": np.tanh,
+    "relu": lambda x: np.maximum(x, 0),
+}
+
+
+# Export the actor of a trained (PPO) MlpPolicy, together with the observation normalization statistics
+# of the NormalizeObservation wrapper it was trained with, to a compact .npz file.
+# Only the layers needed to pick an action are exported (the value network is not).
+# Before saving, the exported network is checked against the torch policy on a few sample observations.
+def export_policy(model, path, obs_rms=None, epsilon=1e-8, n_check=32, atol=1e-3):
+    policy = model.policy
+
+    activation = policy.activation_fn.__name__.lower()
+    if activation not in activations:
+        raise ValueError(f"Unsupported activation function: {policy.activation_fn.__name__}")
+
+    # The linear layers of the policy network, followed by the action (logits) layer
+    layers = [layer for layer in policy.mlp_extractor.policy_net if hasattr(layer, "weight")]
+    layers.append(policy.action_net)
+
+    arrays = {}
+    for i, layer in enumerate(layers):
+        # torch stores the weights as (out, in), we store them as (in, out) so that a layer is obs @ W + b
+        arrays[f"W{i}"] = layer.weight.detach().cpu().numpy().T.astype(np.float32)
+        arrays[f"b{i}"] = layer.bias.detach().cpu().numpy().astype(np.float32)
+
+    n_obs = arrays["W0"].shape[0]
+    if obs_rms is None:
+        arrays["obs_mean"] = np.zeros(n_obs)
+        arrays["obs_var"] = np.ones(n_obs)
+        epsilon = 0.0
+    else:
+        arrays["obs_mean"] = np.asarray(obs_rms.mean, dtype=np.float64)
+        arrays["obs_var"] = np.asarray(obs_rms.var, dtype=np.float64)
+
+    check_export(model, arrays, len(layers), activation, epsilon, n_check, atol)
+
+    np.savez(path,
+             n_layers=len(layers),
+             activation=activation,
+             epsilon=epsilon,
+             **arrays)
+
+
+# Compare the action log-probabilities of the exported network (on raw observations) with those of the torch policy
+# (on the same observations, normalized as during training), and raise when they do not match
+def check_export(model, arrays, n_layers, activation, epsilon, n_check, atol):
+    import torch
+
+    exported = NumpyPolicy(weights=[arrays[f"W{i}"] for i in range(n_layers)],
+                           biases=[arrays[f"b{i}"] for i in range(n_layers)],
+                           activation=activation,
+                           obs_mean=arrays["obs_mean"],
+                           obs_var=arrays["obs_var"],
+                           epsilon=epsilon)
+
+    observations = np.stack([model.observation_space.sample() for _ in range(n_check)]).astype(np.float64)
+    normalized = (observations - arrays["obs_mean"]) / np.sqrt(arrays["obs_var"] + epsilon)
+
+    with torch.no_grad():
+        obs_tensor, _ = model.policy.obs_to_tensor(normalized.astype(np.float32))
+        torch_log_probs = model.policy.get_distribution(obs_tensor).distribution.logits.cpu().numpy()
+
+    logits = exported.logits(observations)
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    log_probs = shifted - np.log(np.exp(shifted).sum(axis=1, keepdims=True))
+
+    if not np.allclose(log_probs, torch_log_probs, atol=atol):
+        error = np.max(np.abs(log_probs - torch_log_probs))
+        raise ValueError(f"The exported policy does not match the torch policy (max log-probability error {error:.2e})")
+
+
+# Batched forward passes of an exported policy, in pure NumPy (no torch or stable-baselines3 needed).
+# The observation normalization is folded into the first layer, so a forward pass is only a few matrix products.
+# predict therefore expects raw observations (expects_raw_obs), do not normalize them again (e.g. with obs_rms in rollout_policy).
+class NumpyPolicy:
+    expects_raw_obs = True
+
+    def __init__(self, weights, biases, activation, obs_mean, obs_var, epsilon=1e-8):
+        std = np.sqrt(obs_var + epsilon)
+
+        # (obs - mean) / std @ W + b == obs @ (W / std) + (b - (mean / std) @ W)
+        first_w = weights[0] / std[:, None]
+        first_b = biases[0] - (obs_mean / std) @ weights[0]
+
+        self.weights = [first_w.astype(np.float32)] + [w.astype(np.float32) for w in weights[1:]]
+        self.biases = [first_b.astype(np.float32)] + [b.astype(np.float32) for b in biases[1:]]
+        self.activation = activations[activation]
+        self.rng = np.random.default_rng()
+
+    def set_random_seed(self, seed):
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            n_layers = int(data["n_layers"])
+            return cls(weights=[data[f"W{i}"] for i in range(n_layers)],
+                       biases=[data[f"b{i}"] for i in range(n_layers)],
+                       activation=str(data["activation"]),
+                       obs_mean=data["obs_mean"],
+                       obs_var=data["obs_var"],
+                       epsilon=float(data["epsilon"]))
+
+    # The action logits for a batch of (raw, unnormalized) observations
+    def logits(self, observations):
+        x = np.asarray(observations, dtype=np.float32)
+        for w, b in zip(self.weights[:-1], self.biases[:-1]):
+            x = self.activation(x @ w + b)
+        return x @ self.weights[-1] + self.biases[-1]
+
+    # Mirrors model.predict of stable-baselines3, so it can be used wherever a model is expected
+    def predict(self, observation, deterministic=True):
+        observation = np.asarray(observation)
+        single = observation.ndim == 1
+        logits = self.logits(observation[None] if single else observation)
+
+        if deterministic:
+            actions = np.argmax(logits, axis=-1)
+        else:
+            # Sample from the categorical distribution with the Gumbel-max trick
+            actions = np.argmax(logits + self.rng.gumbel(size=logits.shape), axis=-1)
+
+        return (actions[0] if single else actions), None
@@ -0,0 +1,112 @@
+import itertools
+import numpy as np
+from sir_env import make_sir_env
+
+
+# Build the scenario grid (one scenario per combination of seeds, beta, population and budget)
+def make_scenarios(seeds, betas, populations, budgets, gamma):
+    scenarios = []
+    for s, beta, (N_c, N_a), budget in itertools.product(seeds, betas, populations, budgets):
+        scenarios.append({
+            "seeds": s,
+            "beta": beta,
+            "gamma": gamma,
+            "N_c": N_c,
+            "N_a": N_a,
+            "budget": budget,
+        })
+    return scenarios
+
+
+# Normalize the observations with the statistics of a (frozen) NormalizeObservation wrapper
+def normalize_obs(obs, obs_rms, epsilon=1e-8):
+    if obs_rms is None:
+        return obs
+    return (obs - obs_rms.mean) / np.sqrt(obs_rms.var + epsilon)
+
+
+# Roll out a model over all scenarios at once, batching the model.predict calls across the environments.
+# Every trajectory is recorded once into shared arrays:
+#   states:  (n_scenarios, n_steps + 1, n_compartments), the model state before every step and after the last one
+#   actions: (n_scenarios, n_steps), the actions that were actually applied (i.e. after the budget check)
+#   rewards: (n_scenarios, n_steps)
+#   t:       (n_steps + 1,), the time (in days) of each recorded state
+# When comparing policies, pass the same seed to use common random numbers: the environments are reset
+# with the same seeds and the model's own random number generators are reseeded before the rollout.
+# Models that normalize the observations themselves (expects_raw_obs, e.g. numpy_policy.NumpyPolicy) must not get obs_rms.
+def rollout_policy(model, scenarios, deterministic=True, obs_rms=None, seed=None):
+    if obs_rms is not None and getattr(model, "expects_raw_obs", False):
+        raise ValueError("This model normalizes the observations itself, do not pass obs_rms")
+
+    envs = [make_sir_env(sc["budget"], seeds=sc["seeds"], N_c=sc["N_c"], N_a=sc["N_a"], gamma=sc["gamma"], beta=sc["beta"])
+            for sc in scenarios]
+
+    if seed is not None and hasattr(model, "set_random_seed"):
+        model.set_random_seed(seed)
+
+    observations = np.stack([env.reset(seed=None if seed is None else seed + i)[0] for i, env in enumerate(envs)]).astype(np.float64)
+
+    states = [np.stack([env.unwrapped.model_state for env in envs]).astype(np.float64)]
+    actions = []
+    rewards = []
+    t = [0]
+
+    done = np.zeros(len(envs), dtype=bool)
+    while not done.all():
+        predicted, _ = model.predict(normalize_obs(observations, obs_rms), deterministic=deterministic)
+
+        step_actions = np.zeros(len(envs), dtype=bool)
+        step_rewards = np.zeros(len(envs))
+        for i, env in enumerate(envs):
+            if done[i]:
+                continue
+            observations[i], step_rewards[i], terminated, truncated, info = env.step(int(predicted[i]))
+            # The environment applies the budget, so we record the action it actually took
+            step_actions[i] = env.unwrapped.params["schools_closed"]
+            done[i] = terminated or truncated
+
+        states.append(np.stack([env.unwrapped.model_state for env in envs]).astype(np.float64))
+        actions.append(step_actions)
+        rewards.append(step_rewards)
+        t.append(max(env.unwrapped._t for env in envs))
+
+    for env in envs:
+        env.close()
+
+    return {
+        "scenarios": scenarios,
+        "t": np.array(t),
+        "states": np.stack(states, axis=1),
+        "actions": np.stack(actions, axis=1),
+        "rewards": np.stack(rewards, axis=1),
+    }
+
+
+# Evaluate a model: the mean and std of the (undiscounted) episode return over all scenarios
+def evaluate_rollouts(rollouts):
+    returns = rollouts["rewards"].sum(axis=1)
+    return returns.mean(), returns.std()
+
+
+# Compare several models on the same scenarios using common random numbers.
+# Every model brings its own observation normalization: models maps a name to (model, obs_rms),
+# with obs_rms the statistics of the NormalizeObservation wrapper that model was trained behind
+# (or None for a model that takes raw observations, e.g. a numpy_policy.NumpyPolicy).
+def compare_policies(models, scenarios, deterministic=True, seed=0):
+    results = {}
+    for name, (model, obs_rms) in models.items():
+        rollouts = rollout_policy(model, scenarios, deterministic=deterministic, obs_rms=obs_rms, seed=seed)
+        results[name] = rollouts
+    return results
+
+
+# The per-scenario difference in return between two policies, rolled out with common random numbers:
+# the mean difference and its standard error (nan for a single scenario, where it cannot be estimated)
+def paired_difference(results, a, b):
+    returns_a = results[a]["rewards"].sum(axis=1)
+    returns_b = results[b]["rewards"].sum(axis=1)
+    diff = returns_a - returns_b
+    if len(diff) < 2:
+        return diff.mean(), np.nan
+    return diff.mean(), diff.std(ddof=1) / np.sqrt(len(diff))
+
@@ -1,10 +1,23 @@
+import copy
+import os
 import numpy as np
 from scipy.integrate import odeint
+from contact_matrices import load_contact_matrix, beta_from_R0
+
+# Contact Matrix
+# Entry (i, j) is the mean number of daily contacts of age class i with age class j, loaded from data/.
+# Any number of age classes is supported, e.g. with other matrices loaded by contact_matrices.load_contact_matrix.
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+age_groups, contact_matrix = load_contact_matrix(os.path.join(data_dir, "contact_matrix.csv"))
+_, contact_matrix_schools_closed = load_contact_matrix(os.path.join(data_dir, "contact_matrix_schools_closed.csv"))
 
 # Disease parameters
+# beta is derived from the target R0 (with the contact matrix when schools are open)
+R0 = 2.94
+gamma = 1/7
 disease_params = {
-    "beta": 0.02,
-    "gamma": 1/7,
+    "beta": beta_from_R0(R0, gamma, contact_matrix),
+    "gamma": gamma,
     "schools_closed": False
 }
 seeds=1
@@ -12,25 +25,29 @@ N_c=3666
 N_a=7334
 
 
-# Contact Matrix
-contact_matrix = [[18, 9], [3, 12]]
-contact_matrix_schools_closed = [[0, 5], [2, 8]]
-
-def contacts(i, j, schools_closed):
-    if schools_closed:
-        return contact_matrix_schools_closed[i][j]
+# The contact matrix in use, params can override the default matrices with "contact_matrix" and "contact_matrix_schools_closed"
+def contacts(params):
+    if params["schools_closed"]:
+        return params.get("contact_matrix_schools_closed", contact_matrix_schools_closed)
     else:
-        return contact_matrix[i][j]
+        return params.get("contact_matrix", contact_matrix)
 
 
 # Transition rates
-def foi(i, params, Ns, ac_idx, acs, schools_closed):
-    foi_value = 0
+# The force of infection for all age classes at once, i holds the infected individuals per age class
+# (a 1-D array, or one row per replicate); used by both the ODE and the binomial chain solver
+def foi(i, params, Ns):
+    return params["beta"] * (i / Ns) @ np.asarray(contacts(params)).T
 
-    for ac_j in range(acs):
-        foi_value += params["beta"] * contacts(ac_idx, ac_j, schools_closed) * i[ac_j] / Ns[ac_j]
-        
-    return foi_value
+# The school closure budget: schools can only be closed while budget is left (a budget of None is unlimited).
+# Returns whether the schools are closed and the updated used budget.
+def apply_budget(close_schools, used_budget, budget):
+    if budget is not None and used_budget >= budget:
+        close_schools = False
+
+    if close_schools:
+        used_budget += 1
+    return close_schools, used_budget
 
 def i_r(params):
     return params["gamma"]
@@ -40,6 +57,14 @@ def initialise_modelstate(seeds, N_c, N_a):
     # S_c, I_c, R_c, S_a, I_a, R_a
     return np.array([N_c - seeds, seeds, 0, N_a - seeds, seeds, 0])
 
+# The model state for any number of age classes: S, I, R per age class
+def initialise_modelstate_ages(seeds, Ns):
+    Ns = np.asarray(Ns)
+    state = np.zeros((len(Ns), 3), dtype=Ns.dtype)
+    state[:, 0] = Ns - seeds
+    state[:, 1] = seeds
+    return state.ravel()
+
 # ODE Solver
 
 def ode_system(y0, t, parameters):
@@ -47,32 +72,128 @@ def ode_system(y0, t, parameters):
     params = parameters["disease_params"]
     Ns = parameters["Ns"]
 
-    s_c, i_c, r_c, s_a, i_a, r_a = y0
-    ds_c, di_c, dr_c, ds_a, di_a, dr_a = 0, 0, 0, 0, 0, 0
+    # One row (S, I, R) per age class
+    y = y0.reshape(-1, 3)
+    s, i = y[:, 0], y[:, 1]
 
-    # Calculating the rates of change for children and adults   
-    ds_c += (- foi([i_c, i_a], params, Ns, 0, 2, params["schools_closed"]) * s_c)
-    di_c += foi([i_c, i_a], params, Ns, 0, 2, params["schools_closed"]) * s_c - i_r(params) * i_c
-    dr_c += i_r(params) * i_c
+    # Calculating the rates of change for all age classes
+    new_infections = foi(i, params, Ns) * s
+    new_recoveries = i_r(params) * i
 
-    ds_a += (- foi([i_c, i_a],  params, Ns, 1, 2, params["schools_closed"]) * s_a)
-    di_a += foi([i_c, i_a], params, Ns, 1, 2, params["schools_closed"]) * s_a - i_r(params) * i_a
-    dr_a +=  i_r(params) * i_a
+    dy = np.empty_like(y)
+    dy[:, 0] = - new_infections
+    dy[:, 1] = new_infections - new_recoveries
+    dy[:, 2] = new_recoveries
 
-    return ds_c, di_c, dr_c, ds_a, di_a, dr_a    
+    return dy.ravel()
 
-def run_sir_model(model_state, end_t, params, Ns):
+# With full_output, the solver diagnostics (number of RHS evaluations and solver steps) are returned as well
+def run_sir_model(model_state, end_t, params, Ns, full_output=False):
     all_parameters = {
         "disease_params": params,
-        "Ns": Ns
+        "Ns": np.asarray(Ns, dtype=float)
     }
 
     # Initial conditions (modelstates, timesteps)   
-    y0 = (*model_state,)
+    y0 = np.asarray(model_state, dtype=float)
     t = np.linspace(0, end_t, end_t)
     
     # Solving the ODE system
-    ret = odeint(ode_system, y0, t, args=(all_parameters,))
-    s_c, i_c, r_c, s_a, i_a, r_a = ret.T
-
-    return np.array([s_c[-1], i_c[-1], r_c[-1], s_a[-1], i_a[-1], r_a[-1]])
+    if full_output:
+        ret, infodict = odeint(ode_system, y0, t, args=(all_parameters,), full_output=True)
+    else:
+        ret = odeint(ode_system, y0, t, args=(all_parameters,))
+
+    new_model_state = ret[-1]
+
+    if full_output:
+        # nfe and nst are cumulative over the output times
+        diagnostics = {
+            "rhs_evals": int(infodict["nfe"][-1]) if len(infodict["nfe"]) else 0,
+            "solver_steps": int(infodict["nst"][-1]) if len(infodict["nst"]) else 0,
+        }
+        return new_model_state, diagnostics
+
+    return new_model_state
+
+
+# Binomial chain solver
+# Simulates many stochastic replicates of the same model at once; the state has shape (replicates, compartments),
+# with S, I, R per age class (Ns holds the population size per age class).
+# Like SIREnv, it can be snapshot and restored (including its random stream) to branch counterfactual scenarios.
+class BinomialChain:
+    def __init__(self, seeds, Ns, params, replicates=1, budget=None, steps_per_day=10, seed=None):
+        self.seeds = seeds
+        self.Ns = np.asarray(Ns, dtype=float)
+        self.params = dict(params)
+        self.replicates = replicates
+        self.budget = budget
+        self.steps_per_day = steps_per_day
+        self.rng = np.random.default_rng(seed)
+        self.reset()
+
+    def reset(self):
+        self.t = 0
+        self.used_budget = 0
+        initial_state = initialise_modelstate_ages(self.seeds, self.Ns.astype(np.int64))
+        self.model_state = np.tile(initial_state, (self.replicates, 1))
+        return self.model_state
+
+    # Simulate the given number of days, with the schools closed or open (subject to the budget, as in SIREnv)
+    def step(self, days, close_schools=False):
+        close_schools, self.used_budget = apply_budget(close_schools, self.used_budget, self.budget)
+        self.params["schools_closed"] = close_schools
+
+        dt = 1 / self.steps_per_day
+        p_rec = 1 - np.exp(-i_r(self.params) * dt)
+
+        # A (replicates, age classes, S/I/R) view on the model state
+        state = self.model_state.reshape(self.replicates, -1, 3)
+        for _ in range(days * self.steps_per_day):
+            s = state[:, :, 0]
+            i = state[:, :, 1]
+
+            # The force of infection for all age classes, for all replicates at once
+            foi_values = foi(i, self.params, self.Ns)
+            new_i = self.rng.binomial(s, 1 - np.exp(-foi_values * dt))
+            new_r = self.rng.binomial(i, p_rec)
+
+            state[:, :, 0] -= new_i
+            state[:, :, 1] += new_i - new_r
+            state[:, :, 2] += new_r
+
+        self.t += days
+        return self.model_state
+
+    def snapshot(self):
+        return {
+            "model_state": self.model_state.copy(),
+            "used_budget": self.used_budget,
+            "t": self.t,
+            "schools_closed": self.params["schools_closed"],
+            "rng_state": copy.deepcopy(self.rng.bit_generator.state),
+        }
+
+    def restore(self, snapshot):
+        self.model_state = snapshot["model_state"].copy()
+        self.used_budget = snapshot["used_budget"]
+        self.t = snapshot["t"]
+        self.params["schools_closed"] = snapshot["schools_closed"]
+        self.rng.bit_generator.state = copy.deepcopy(snapshot["rng_state"])
+        return self.model_state
+
+
+# Run counterfactual branches (sequences of school closure decisions) from a shared snapshot.
+# Every branch restarts from the same state and random stream, so the replicates are paired across branches
+# and the common prefix is not simulated again. Returns the states with shape (branches, steps + 1, replicates, compartments).
+def run_branches(sim, snapshot, action_sequences, days=7):
+    branches = []
+    for actions in action_sequences:
+        sim.restore(snapshot)
+        trajectory = [sim.model_state.copy()]
+        for close_schools in actions:
+            trajectory.append(sim.step(days, close_schools).copy())
+        branches.append(np.stack(trajectory))
+
+    sim.restore(snapshot)
+    return np.stack(branches)
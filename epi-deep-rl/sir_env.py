@@ -1,10 +1,11 @@
+import time
 import numpy as np
 import gymnasium as gym
 from gymnasium import spaces
-from sir import initialise_modelstate, run_sir_model
+from sir import initialise_modelstate, run_sir_model, apply_budget
 
 class SIREnv(gym.Env):
-    def __init__(self, budget, compartments, seeds, N_c, N_a, params):
+    def __init__(self, budget, compartments, seeds, N_c, N_a, params, metrics=None):
         self.budget = budget
         self.seeds = seeds
         self.N_c = N_c
@@ -12,15 +13,26 @@ class SIREnv(gym.Env):
         self.N = N_c + N_a
         self.params = params
         self.compartments = compartments
+        # Optional instrumentation.StepMetrics, when given every step is timed and the solver diagnostics are recorded
+        self.metrics = metrics
 
         # Define the action and observation space
         self.action_space = gym.spaces.Discrete(2)
         self.observation_space = spaces.Box(0, max(N_c, N_a), shape=(len(compartments),), dtype=np.float32)
 
-    # Return the current model state
+        # The model state is kept in float64, as used by the ODE solver
+        self.model_state = np.zeros(len(compartments), dtype=np.float64)
+        # The population sizes as an array, so run_sir_model does not convert them every step
+        self._Ns = np.array([N_c, N_a], dtype=float)
+
+        # The indices of the susceptible compartments, used to compute the reward
+        self._s_c_idx = compartments.index("S_c")
+        self._s_a_idx = compartments.index("S_a")
+
+    # Return the current model state, as a new float32 array (the dtype of the observation space)
     def _get_obs(self):
         #the np.maximum avoid that we get small negative numbers
-        return np.maximum(self.model_state,0)
+        return np.maximum(self.model_state, 0).astype(np.float32)
     
     # This is not mandatory, but can be useful for debugging
     def _get_info(self):
@@ -33,30 +45,50 @@ class SIREnv(gym.Env):
         super().reset(seed=seed)
         self._t = 0
         self.used_budget = 0
-        self.model_state = initialise_modelstate(self.seeds, self.N_c, self.N_a)
+        self.model_state[:] = initialise_modelstate(self.seeds, self.N_c, self.N_a)
+        return self._get_obs(), self._get_info()
+
+    # Snapshot the simulator state (model state, budget and time), to branch counterfactual scenarios from a shared past.
+    # SIREnv is deterministic (it never draws from np_random), so there is no random state to save.
+    # Only the state of this (unwrapped) env is saved, not that of the wrappers gym.make adds (e.g. the step
+    # counter of TimeLimit): take snapshots of env.unwrapped and step env.unwrapped in the branches, as run_env_branches does.
+    def snapshot(self):
+        return {
+            "model_state": np.array(self.model_state, copy=True),
+            "used_budget": self.used_budget,
+            "t": self._t,
+            "schools_closed": self.params["schools_closed"],
+        }
+
+    # Restore a snapshot taken with snapshot(), the observation and info are returned as after a reset
+    def restore(self, snapshot):
+        self.model_state[:] = snapshot["model_state"]
+        self.used_budget = snapshot["used_budget"]
+        self._t = snapshot["t"]
+        self.params["schools_closed"] = snapshot["schools_closed"]
         return self._get_obs(), self._get_info()
 
 
     # Perform a step in the environment given an action
     def step(self, action):
-        close_schools = (action == 1)
+        if self.metrics is not None:
+            start = time.perf_counter()
 
         # If the budget is zero, we cannot close the schools
-        if self.used_budget >= self.budget:
-            close_schools = False
-
-        if close_schools:
-            self.used_budget += 1
+        close_schools, self.used_budget = apply_budget(action == 1, self.used_budget, self.budget)
         self.params["schools_closed"] = close_schools
             
-        end_t = self._get_info()["t"] + 7
+        end_t = self._t + 7
         
-        new_model_state = run_sir_model(self.model_state, end_t, self.params, [self.N_c, self.N_a])
+        if self.metrics is None:
+            new_model_state = run_sir_model(self.model_state, end_t, self.params, self._Ns)
+        else:
+            new_model_state, diagnostics = run_sir_model(self.model_state, end_t, self.params, self._Ns, full_output=True)
 
-        _new_s = (new_model_state[self.compartments.index("S_c")]+new_model_state[self.compartments.index("S_a")]) 
-        _old_s = (self.model_state[self.compartments.index("S_c")]+self.model_state[self.compartments.index("S_a")])
+        _new_s = (new_model_state[self._s_c_idx]+new_model_state[self._s_a_idx]) 
+        _old_s = (self.model_state[self._s_c_idx]+self.model_state[self._s_a_idx])
 
-        self.model_state = new_model_state
+        self.model_state[:] = new_model_state
         self._t = end_t
 
         # The reward is the new number of infected individuals, which is calculated as the difference between the old and new number of susceptible individuals
@@ -64,15 +96,22 @@ class SIREnv(gym.Env):
         reward = -(_old_s-_new_s)
         terminated = self._t >= 180
 
-        return self._get_obs(), reward, terminated, False, self._get_info()
+        info = self._get_info()
+        if self.metrics is not None:
+            step_time = time.perf_counter() - start
+            self.metrics.record_step(step_time, diagnostics["rhs_evals"], diagnostics["solver_steps"])
+            info.update(diagnostics, step_time=step_time)
+
+        return self._get_obs(), reward, terminated, False, info
     
-def make_sir_env(budget, seeds, N_c, N_a, gamma, beta):
-    # Register the environment
-    gym.envs.registration.register(
-        id="SIREnv-v0",
-        entry_point="sir_env:SIREnv",
-        max_episode_steps=300
-    )
+def make_sir_env(budget, seeds, N_c, N_a, gamma, beta, metrics=None):
+    # Register the environment (only once, so make_sir_env can be called repeatedly, e.g. in every worker)
+    if "SIREnv-v0" not in gym.envs.registry:
+        gym.envs.registration.register(
+            id="SIREnv-v0",
+            entry_point="sir_env:SIREnv",
+            max_episode_steps=300
+        )
 
     compartments = ["S_c", "I_c", "R_c", "S_a", "I_a", "R_a"]
     
@@ -89,6 +128,27 @@ def make_sir_env(budget, seeds, N_c, N_a, gamma, beta):
                     budget=budget,
                     N_c=N_c,
                     N_a=N_a,
-                    params=params)
+                    params=params,
+                    metrics=metrics)
     
-    return env
\ No newline at end of file
+    return env
+
+
+# Run counterfactual branches (sequences of actions) in SIREnv from a shared snapshot (see SIREnv.snapshot),
+# e.g. closing the schools in week k instead of week k + 1, without re-simulating the common past.
+# Returns the states with shape (branches, steps + 1, compartments), like sir.run_branches,
+# so all action sequences must have the same length.
+def run_env_branches(env, snapshot, action_sequences):
+    sir_env = env.unwrapped
+
+    branches = []
+    for actions in action_sequences:
+        sir_env.restore(snapshot)
+        trajectory = [sir_env.model_state.copy()]
+        for action in actions:
+            sir_env.step(action)
+            trajectory.append(sir_env.model_state.copy())
+        branches.append(np.stack(trajectory))
+
+    sir_env.restore(snapshot)
+    return np.stack(branches)
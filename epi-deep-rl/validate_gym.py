@@ -1,42 +1,15 @@
 import random
 from sir import run_sir_model
 import sir
-import matplotlib.pyplot as plt
-import gymnasium as gym
-from sir import initialise_modelstate
+from sir import initialise_modelstate, apply_budget
+from sir_env import make_sir_env
 
-
-
-# Function to create the gym environment
-def make_sir_env(budget, seeds, N_c, N_a, gamma, beta):
-    # Register the environment
-    gym.envs.registration.register(
-        id="SIREnv-v0",
-        entry_point="sir_env:SIREnv",
-        max_episode_steps=300
-    )
-
-    compartments = ["S_c", "I_c", "R_c", "S_a", "I_a", "R_a"]
-    
-    params = {
-        "beta": beta, #transmission rate
-        "gamma": gamma, #recovery rate
-        "schools_closed": False 
-    }
-
-    #Make the environment
-    env = gym.make("SIREnv-v0",
-                    compartments=compartments,
-                    seeds=seeds,
-                    budget=budget,
-                    N_c=N_c,
-                    N_a=N_a,
-                    params=params)
-    
-    return env
+# validate_gym imports matplotlib when it draws the comparison, not at module load
 
 # Function to validate the gym environment
 def validate_gym(env, seeds, N_c, N_a, params, budget=1000):
+    import matplotlib.pyplot as plt
+
     env.reset()
 
     actions = [random.choice([True, False]) for _ in range(50)]
@@ -55,12 +28,7 @@ def validate_gym(env, seeds, N_c, N_a, params, budget=1000):
     used_budget = 0
     while not done:
         action = actions[step]
-        close_schools = (action == 1)
-        if used_budget >= budget:
-            close_schools = False
-
-        if close_schools:
-            used_budget += 1
+        close_schools, used_budget = apply_budget(action == 1, used_budget, budget)
         params["schools_closed"] = close_schools
         observation, _, terminated, _, _ = env.step(action)
         ode_current_state = run_sir_model(ode_current_state, (step + 1) * 7, params, [N_c, N_a])
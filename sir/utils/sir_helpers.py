@@ -1,9 +1,16 @@
 import numpy as np
 from scipy.integrate import odeint
-import matplotlib.pyplot as plt
 import math
 
+# The plot functions get pyplot through _plt(), so rate_to_p and the ensemble statistics can be used without matplotlib
+
+def _plt():
+    import matplotlib.pyplot as plt
+    return plt
+
 def plot_ODE(modelstate, title, ac=None):
+    plt = _plt()
+
     ac = f"_{ac}" if ac else ""
 
     plt.figure()
@@ -22,6 +29,8 @@ def plot_ODE(modelstate, title, ac=None):
     plt.show()
 
 def plot_ODE_age(modelstate, title, pop):
+    plt = _plt()
+
     plt.figure()
 
     plt.plot(modelstate[f"I_c"], label=f"I_c", color="red")
@@ -38,6 +47,8 @@ def plot_ODE_age(modelstate, title, pop):
     plt.show()
 
 def plot_ODE_R0s(results, title, ac=None):
+    plt = _plt()
+
     ac = f"_{ac}" if ac else ""
 
     plt.figure()
@@ -55,16 +66,129 @@ def plot_ODE_R0s(results, title, ac=None):
 
     plt.show()
 
-def plot_binom_R0s(results, title, ac=None):
+# Single-pass ensemble statistics over (chunks of) stochastic trajectories, so the replicates never have to be kept in memory.
+# The mean is exact. With an upper bound (e.g. the population size), a histogram per time point is built as well:
+# - bins=None: one bin per integer count 0..upper, so the percentiles of binomial chain counts are exact (as np.percentile)
+# - bins=k: k equal-width bins over [0, upper], only for drawing a density image
+# Without an upper bound only the mean is computed, which keeps it cheap.
+class EnsembleReducer:
+    def __init__(self, n_t, upper=None, bins=None):
+        self.n_t = n_t
+        self.upper = upper
+        self.unit_bins = upper is not None and bins is None
+        self.bins = None if upper is None else (int(upper) + 1 if bins is None else bins)
+        self.n = 0
+        self.total = np.zeros(n_t)
+        self.counts = None if upper is None else np.zeros((n_t, self.bins), dtype=np.int32)
+
+    # Add a chunk of trajectories, with shape (replicates, time points)
+    def add(self, chunk):
+        chunk = np.asarray(chunk, dtype=float)
+        self.n += len(chunk)
+        self.total += chunk.sum(axis=0)
+
+        if self.counts is None:
+            return
+
+        if self.unit_bins:
+            idx = np.rint(chunk).astype(np.int64)
+        else:
+            idx = (chunk / max(self.upper, 1) * self.bins).astype(np.int64)
+        np.clip(idx, 0, self.bins - 1, out=idx)
+        idx += np.arange(self.n_t) * self.bins
+        self.counts += np.bincount(idx.ravel(), minlength=self.n_t * self.bins).reshape(self.n_t, self.bins).astype(np.int32)
+
+    def mean(self):
+        return self.total / max(self.n, 1)
+
+    # The q-th percentile (0-100) at every time point, with the same (linear) interpolation between
+    # order statistics as np.percentile; exact for integer counts
+    def percentile(self, q):
+        if not self.unit_bins:
+            raise ValueError("Percentiles need unit-width bins, create the EnsembleReducer with an upper bound and bins=None")
+
+        cdf = np.cumsum(self.counts, axis=1)
+        h = (self.n - 1) * q / 100
+        k = int(np.floor(h))
+
+        # The k-th (0-based) order statistic is the smallest count with more than k replicates at or below it
+        lower = np.argmax(cdf > k, axis=1)
+        upper = np.argmax(cdf > min(k + 1, self.n - 1), axis=1)
+        return lower + (h - k) * (upper - lower)
+
+
+# Reduce trajectories (a list or array of replicates) chunk by chunk, without copying them as a whole.
+# Without upper only the mean is computed, pass the population size as upper to also get the percentiles.
+def reduce_ensemble(trajectories, upper=None, chunk_size=1000, bins=None):
+    reducer = EnsembleReducer(len(trajectories[0]), upper, bins=bins)
+    for start in range(0, len(trajectories), chunk_size):
+        reducer.add(trajectories[start:start + chunk_size])
+    return reducer
+
+
+# The largest unit-width histogram (time points x counts) reduce_ensemble may build for exact percentiles (200 MB as int32),
+# larger populations fall back to np.percentile on the trajectories
+max_histogram_cells = 50_000_000
+
+# The mean and percentile bands of an ensemble, exact in both cases
+def ensemble_bands(trajectories, percentiles, pop=None):
+    n_t = len(trajectories[0])
+    if pop is not None and n_t * (int(pop) + 1) <= max_histogram_cells:
+        reducer = reduce_ensemble(trajectories, upper=pop)
+        return reducer.mean(), [reducer.percentile(q) for q in percentiles]
+
+    trajectories = np.asarray(trajectories, dtype=float)
+    return trajectories.mean(axis=0), [np.percentile(trajectories, q, axis=0) for q in percentiles]
+
+
+# Draw (a decimated subset of) the replicates as one LineCollection instead of one line per replicate
+def plot_trajectories(ax, trajectories, color, max_lines=200, max_points=1000, alpha=0.1):
+    from matplotlib.collections import LineCollection
+
+    n, n_t = len(trajectories), len(trajectories[0])
+
+    line_stride = max(1, math.ceil(n / max_lines))
+    point_stride = max(1, math.ceil(n_t / max_points))
+    # Only the decimated subset is converted to an array
+    subset = np.asarray(trajectories[::line_stride], dtype=float)[:, ::point_stride]
+    t = np.arange(n_t)[::point_stride]
+
+    segments = np.stack([np.broadcast_to(t, subset.shape), subset], axis=-1)
+    ax.add_collection(LineCollection(segments, colors=color, alpha=alpha))
+    ax.autoscale_view()
+
+# Draw the histogram of a reducer as a density image (of all replicates), from transparent to the given color
+def plot_density(ax, reducer, color):
+    from matplotlib.colors import LinearSegmentedColormap, to_rgba
+
+    cmap = LinearSegmentedColormap.from_list(f"density_{color}", [to_rgba(color, 0), to_rgba(color, 1)])
+    density = np.log1p(reducer.counts.T)
+    ax.imshow(density, cmap=cmap, origin="lower", aspect="auto", interpolation="nearest",
+              extent=(0, reducer.n_t - 1, 0, reducer.upper))
+
+# The replicates (as lines or a density image) and the mean of one compartment.
+# The (coarse) histogram over [0, upper] is only built for the density image.
+def plot_ensemble(ax, trajectories, color, label, upper, density=False, density_bins=500):
+    if density:
+        reducer = reduce_ensemble(trajectories, upper=upper, bins=density_bins)
+        plot_density(ax, reducer, color)
+    else:
+        reducer = reduce_ensemble(trajectories)
+        plot_trajectories(ax, trajectories, color)
+
+    ax.plot(reducer.mean(), label=label, color=color)
+    return reducer
+
+def plot_binom_R0s(results, title, ac=None, pop=None):
+    plt = _plt()
+
     ac = f"_{ac}" if ac else ""
 
     plt.figure()
 
     for (R0, modelstate) in results.items():
-        
-        mean_i = np.mean(modelstate[f"I{ac}"], axis=0)
-        lower_95_i = np.percentile(modelstate[f"I{ac}"], 2.5, axis=0)
-        upper_95_i = np.percentile(modelstate[f"I{ac}"], 97.5, axis=0)
+        # In a single pass when the population size is given (and small enough), with np.percentile otherwise
+        mean_i, (lower_95_i, upper_95_i) = ensemble_bands(modelstate[f"I{ac}"], [2.5, 97.5], pop)
 
         plt.plot(mean_i, label=f"I{ac}_R0_{R0}")
         plt.fill_between(range(len(mean_i)), lower_95_i, upper_95_i, alpha=0.3)
@@ -78,23 +202,19 @@ def plot_binom_R0s(results, title, ac=None):
 
     plt.show()
 
-def plot_binom(modelstates, title, ac=None):
+def plot_binom(modelstates, title, ac=None, density=False):
+    plt = _plt()
+
     ac = f"_{ac}" if ac else ""
 
     plt.figure()
+    ax = plt.gca()
 
-    for iteration in range(len(modelstates[f"S{ac}"])):
-        plt.plot(modelstates[f"S{ac}"][iteration], color="blue", alpha=0.1)
-        plt.plot(modelstates[f"I{ac}"][iteration], color="red", alpha=0.1)
-        plt.plot(modelstates[f"R{ac}"][iteration], color="green", alpha=0.1)
-
-    mean_s = np.mean(modelstates[f"S{ac}"], axis=0)
-    mean_i = np.mean(modelstates[f"I{ac}"], axis=0)
-    mean_r = np.mean(modelstates[f"R{ac}"], axis=0)
-
-    plt.plot(mean_s, label=f"S{ac}", color="blue")
-    plt.plot(mean_i, label=f"I{ac}", color="red")
-    plt.plot(mean_r, label=f"R{ac}", color="green")
+    # S + I + R is the (constant) population size, an upper bound for every compartment
+    upper = sum(modelstates[f"{c}{ac}"][0][0] for c in ["S", "I", "R"])
+    plot_ensemble(ax, modelstates[f"S{ac}"], "blue", f"S{ac}", upper, density)
+    plot_ensemble(ax, modelstates[f"I{ac}"], "red", f"I{ac}", upper, density)
+    plot_ensemble(ax, modelstates[f"R{ac}"], "green", f"R{ac}", upper, density)
 
     plt.xlabel("Days")
     plt.ylabel("Number of Individuals")
@@ -105,18 +225,14 @@ def plot_binom(modelstates, title, ac=None):
 
     plt.show()
 
-def plot_binom_age(modelstates, title, pop):
-    plt.figure()
-
-    for iteration in range(len(modelstates[f"I_c"])):
-        plt.plot(modelstates[f"I_c"][iteration], color="red", alpha=0.1)
-        plt.plot(modelstates[f"I_a"][iteration], color="blue", alpha=0.1)
+def plot_binom_age(modelstates, title, pop, density=False):
+    plt = _plt()
 
-    mean_c = np.mean(modelstates[f"I_c"], axis=0)
-    mean_a = np.mean(modelstates[f"I_a"], axis=0)
+    plt.figure()
+    ax = plt.gca()
 
-    plt.plot(mean_c, label=f"I_c", color="red")
-    plt.plot(mean_a, label=f"I_a", color="blue")
+    plot_ensemble(ax, modelstates[f"I_c"], "red", f"I_c", pop, density)
+    plot_ensemble(ax, modelstates[f"I_a"], "blue", f"I_a", pop, density)
 
     plt.xlabel("Days")
     plt.ylabel("Number of Individuals")
@@ -129,6 +245,8 @@ def plot_binom_age(modelstates, title, pop):
     plt.show()
 
 def plot_ODE_w_vacc(modelstate, title, pop):
+    plt = _plt()
+
     plt.figure()
     
     plt.plot(modelstate[f"I_a"], label=f"I_a", color="blue")
@@ -146,24 +264,16 @@ def plot_ODE_w_vacc(modelstate, title, pop):
 
     plt.show()
 
-def plot_binom_w_vacc(modelstates, title, pop):
+def plot_binom_w_vacc(modelstates, title, pop, density=False):
+    plt = _plt()
+
     plt.figure()
+    ax = plt.gca()
 
-    for iteration in range(len(modelstates[f"I_c"])):
-        plt.plot(modelstates[f"I_c"][iteration], color="red", alpha=0.1)
-        plt.plot(modelstates[f"IV_c"][iteration], color="orange", alpha=0.1)   
-        plt.plot(modelstates[f"I_a"][iteration], color="blue", alpha=0.1)
-        plt.plot(modelstates[f"IV_a"][iteration], color="turquoise", alpha=0.1)
-
-    mean_i_c = np.mean(modelstates[f"I_c"], axis=0)
-    mean_iv_c = np.mean(modelstates[f"IV_c"], axis=0)
-    mean_i_a = np.mean(modelstates[f"I_a"], axis=0)
-    mean_iv_a = np.mean(modelstates[f"IV_a"], axis=0)
-
-    plt.plot(mean_i_c, label=f"I_c", color="red")
-    plt.plot(mean_iv_c, label=f"IV_c", color="orange")
-    plt.plot(mean_i_a, label=f"I_a", color="blue")
-    plt.plot(mean_iv_a, label=f"IV_a", color="turquoise")
+    plot_ensemble(ax, modelstates[f"I_c"], "red", f"I_c", pop, density)
+    plot_ensemble(ax, modelstates[f"IV_c"], "orange", f"IV_c", pop, density)
+    plot_ensemble(ax, modelstates[f"I_a"], "blue", f"I_a", pop, density)
+    plot_ensemble(ax, modelstates[f"IV_a"], "turquoise", f"IV_a", pop, density)
 
     plt.xlabel("Days")
     plt.ylabel("Number of Individuals")
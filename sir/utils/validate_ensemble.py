@@ -0,0 +1,33 @@
+import numpy as np
+from sir_helpers import reduce_ensemble, ensemble_bands
+
+
+# Check that the single-pass ensemble statistics match np.mean / np.percentile on binomial chain-like counts,
+# including the small counts of the early epidemic and the tails
+def validate_ensemble(replicates=5000, n_t=181, pop=11000, seed=0):
+    rng = np.random.default_rng(seed)
+
+    # Small counts (0-5 individuals), and counts over the whole range of the population
+    small = rng.binomial(5, rng.uniform(0, 1, n_t), size=(replicates, n_t))
+    large = rng.binomial(pop, rng.uniform(0, 1, n_t), size=(replicates, n_t))
+
+    percentiles = [0, 2.5, 25, 50, 75, 97.5, 100]
+    for name, trajectories in [("small counts", small), ("large counts", large)]:
+        reducer = reduce_ensemble(trajectories, upper=pop, chunk_size=700)
+
+        assert np.allclose(reducer.mean(), trajectories.mean(axis=0)), name
+        for q in percentiles:
+            assert np.allclose(reducer.percentile(q), np.percentile(trajectories, q, axis=0)), f"{name}, q={q}"
+
+        # The same bands, through the np.percentile fallback (no population size given)
+        mean, bands = ensemble_bands(trajectories.tolist(), percentiles)
+        assert np.allclose(mean, trajectories.mean(axis=0)), name
+        for q, band in zip(percentiles, bands):
+            assert np.allclose(band, np.percentile(trajectories, q, axis=0)), f"{name}, q={q} (fallback)"
+
+    print("Ensemble statistics match np.mean / np.percentile")
+
+
+# Run the validation
+if __name__ == "__main__":
+    validate_ensemble()